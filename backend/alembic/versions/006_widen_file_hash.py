@@ -0,0 +1,37 @@
+"""widen documents.file_hash for prefixed digests
+
+Revision ID: 006_widen_file_hash
+Revises: 005_add_title_to_chunks
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_widen_file_hash'
+down_revision = '005_add_title_to_chunks'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Allow algorithm-prefixed digests such as 'b3:<64 hex chars>'."""
+    op.alter_column(
+        'documents',
+        'file_hash',
+        existing_type=sa.String(length=64),
+        type_=sa.String(length=80),
+        existing_nullable=False
+    )
+
+
+def downgrade() -> None:
+    """Shrink file_hash back to plain 64-char SHA-256 digests."""
+    op.alter_column(
+        'documents',
+        'file_hash',
+        existing_type=sa.String(length=80),
+        type_=sa.String(length=64),
+        existing_nullable=False
+    )
@@ -17,6 +17,7 @@ from app.models.user import User
 from app.models.document import Document
 from app.api.dependencies.auth import get_current_admin_user
 from app.core.security import get_password_hash, validate_password_strength, validate_email
+from app.utils.file_utils import FileHandler
 
 
 router = APIRouter()
@@ -481,7 +482,7 @@ async def get_system_stats(
         select(func.sum(Document.file_size_bytes)).select_from(Document)
     )
     storage_bytes = storage_result.scalar() or 0
-    storage_mb = storage_bytes / (1024 * 1024)
+    storage_mb = FileHandler.get_file_size_mb_from_bytes(storage_bytes)
     
     return SystemStatsResponse(
         total_users=total_users,
@@ -115,7 +115,7 @@ async def upload_document(
                 filename=existing_doc.filename,
                 status="duplicate",
                 message="This document already exists in the system",
-                file_size_mb=round(file_size / (1024 * 1024), 2)
+                file_size_mb=round(file_handler.get_file_size_mb_from_bytes(file_size), 2)
             )
         
     except Exception as e:
@@ -166,7 +166,7 @@ async def upload_document(
         filename=document.filename,
         status="processing",
         message="Document uploaded successfully and queued for processing",
-        file_size_mb=round(file_size / (1024 * 1024), 2)
+        file_size_mb=round(file_handler.get_file_size_mb_from_bytes(file_size), 2)
     )
 
 
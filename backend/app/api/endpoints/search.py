@@ -2,18 +2,36 @@
 Search API endpoints for testing retrieval system.
 Provides endpoints to test different search strategies.
 """
-from typing import Optional, List
-from fastapi import APIRouter, Depends, Query
+import asyncio
+from typing import Annotated, Optional, List
+from fastapi import APIRouter, Depends, Query, Header
+from fastapi.responses import PlainTextResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field
 from loguru import logger
 
-from app.db.session import get_db
+from app.db.session import get_db, AsyncSessionLocal
 from app.services.retrieval.pipeline import retrieval_pipeline
+from app.services.embedding.embedding_service import embedding_service
 
 
 router = APIRouter()
 
+# Default content preview length for search results
+PREVIEW_CHARS = 500
+
+# Batch queries retrieved at once; each one holds a pooled DB connection
+BATCH_MAX_CONCURRENCY = 4
+
+
+def _preview_content(content: str, preview_chars: int = 0) -> str:
+    """Truncate chunk content for a search response (0 = default preview)."""
+    if preview_chars:
+        return content[:preview_chars]
+    if len(content) > PREVIEW_CHARS:
+        return content[:PREVIEW_CHARS] + '...'
+    return content
+
 
 # Response Models
 class ChunkResult(BaseModel):
@@ -39,6 +57,21 @@ class SearchResponse(BaseModel):
     total_context_tokens: int
 
 
+class BatchSearchRequest(BaseModel):
+    """Several search queries sent in one request."""
+    queries: List[Annotated[str, Field(min_length=1)]] = Field(..., min_length=1, max_length=20, description="Search queries")
+    top_k: int = Field(5, ge=1, le=20, description="Number of results per query")
+    doc_type: Optional[str] = Field(None, description="Filter by document type")
+    department: Optional[str] = Field(None, description="Filter by department")
+    preview_chars: int = Field(0, ge=0, le=PREVIEW_CHARS, description="Truncate chunk content (0 = default preview)")
+
+
+class BatchSearchResponse(BaseModel):
+    """Per-query results for a batch search."""
+    total_queries: int
+    results: List[SearchResponse]
+
+
 class SourceInfo(BaseModel):
     """Source citation information."""
     document: str
@@ -57,12 +90,46 @@ class ContextResponse(BaseModel):
     retrieval_metadata: dict
 
 
+def _build_search_response(query: str, result: dict, preview_chars: int = 0) -> SearchResponse:
+    """Format a retrieval pipeline result as a SearchResponse."""
+    # Format chunks for response
+    chunks = []
+    for chunk in result['chunks']:
+        chunk_result = ChunkResult(
+            chunk_id=chunk['chunk_id'],
+            document_id=chunk['document_id'],
+            content=_preview_content(chunk['content'], preview_chars),
+            chunk_type=chunk['chunk_type'],
+            page_numbers=chunk['page_numbers'],
+            section_title=chunk.get('section_title'),
+            relevance_score=chunk.get('rerank_score', chunk.get('fused_score', 0)),
+            metadata={
+                'document_title': chunk['metadata'].get('document_title'),
+                'doc_type': chunk['metadata'].get('doc_type'),
+                'department': chunk['metadata'].get('department'),
+            }
+        )
+        chunks.append(chunk_result)
+    
+    return SearchResponse(
+        query=query,
+        total_results=len(chunks),
+        chunks=chunks,
+        retrieval_strategy=result['retrieval_metadata']['search_strategy'],
+        intent=result['retrieval_metadata']['intent'],
+        complexity=result['retrieval_metadata']['complexity'],
+        total_context_tokens=result['total_tokens']
+    )
+
+
 @router.post("/search", response_model=SearchResponse)
 async def search(
     query: str = Query(..., description="Search query", min_length=1),
     top_k: int = Query(5, ge=1, le=20, description="Number of results"),
     doc_type: Optional[str] = Query(None, description="Filter by document type"),
     department: Optional[str] = Query(None, description="Filter by department"),
+    preview_chars: int = Query(0, ge=0, le=PREVIEW_CHARS, description="Truncate chunk content to this many characters (0 = default preview)"),
+    fields: Optional[List[str]] = Query(None, description="Only return these chunk fields (e.g. metadata)"),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -91,33 +158,58 @@ async def search(
         include_context=False  # Don't expand for search endpoint
     )
     
-    # Format chunks for response
-    chunks = []
-    for chunk in result['chunks']:
-        chunk_result = ChunkResult(
-            chunk_id=chunk['chunk_id'],
-            document_id=chunk['document_id'],
-            content=chunk['content'][:500] + '...' if len(chunk['content']) > 500 else chunk['content'],
-            chunk_type=chunk['chunk_type'],
-            page_numbers=chunk['page_numbers'],
-            section_title=chunk.get('section_title'),
-            relevance_score=chunk.get('rerank_score', chunk.get('fused_score', 0)),
-            metadata={
-                'document_title': chunk['metadata'].get('document_title'),
-                'doc_type': chunk['metadata'].get('doc_type'),
-                'department': chunk['metadata'].get('department'),
-            }
-        )
-        chunks.append(chunk_result)
+    response = _build_search_response(query, result, preview_chars)
     
-    return SearchResponse(
-        query=query,
-        total_results=len(chunks),
-        chunks=chunks,
-        retrieval_strategy=result['retrieval_metadata']['search_strategy'],
-        intent=result['retrieval_metadata']['intent'],
-        complexity=result['retrieval_metadata']['complexity'],
-        total_context_tokens=result['total_tokens']
+    if fields:
+        # Project chunks down to the requested fields; unknown names are ignored
+        chunk_fields = set(fields) & set(ChunkResult.model_fields)
+        data = response.model_dump(exclude={'chunks'})
+        data['chunks'] = [chunk.model_dump(include=chunk_fields) for chunk in response.chunks]
+        return JSONResponse(content=data)
+    
+    return response
+
+
+@router.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest):
+    """
+    Run several searches in one request.
+    
+    All queries are embedded together in a single embedding call; each
+    query then goes through the normal retrieval pipeline, up to
+    BATCH_MAX_CONCURRENCY at a time.
+    
+    Example:
+    ```
+    POST /search/batch {"queries": ["revenue breakdown", "salary policy"], "top_k": 5}
+    ```
+    """
+    logger.info(f"Batch search request: {len(request.queries)} queries, top_k={request.top_k}")
+    
+    query_embeddings = await embedding_service.embed_queries(request.queries)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    
+    async def run_query(query: str, query_embedding: List[float]) -> SearchResponse:
+        # An AsyncSession can't be shared between concurrent tasks, so each query gets its own
+        async with semaphore, AsyncSessionLocal() as db:
+            result = await retrieval_pipeline.retrieve(
+                query=query,
+                db=db,
+                top_k=request.top_k,
+                doc_type=request.doc_type,
+                department=request.department,
+                include_context=False,
+                query_embedding=query_embedding
+            )
+        return _build_search_response(query, result, request.preview_chars)
+    
+    results = await asyncio.gather(
+        *(run_query(query, embedding) for query, embedding in zip(request.queries, query_embeddings))
+    )
+    
+    return BatchSearchResponse(
+        total_queries=len(results),
+        results=results
     )
 
 
@@ -127,6 +219,7 @@ async def search_with_context(
     top_k: int = Query(5, ge=1, le=20),
     doc_type: Optional[str] = Query(None),
     department: Optional[str] = Query(None),
+    accept: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -139,6 +232,10 @@ async def search_with_context(
     - Debug retrieval quality
     - Test context assembly
     - Verify source citations
+    
+    Send `Accept: text/plain` to get just the context text (no JSON
+    wrapping); the counts are returned in X-Total-Tokens, X-Chunks-Used
+    and X-Sources-Count headers.
     """
     logger.info(f"Context search: query='{query}'")
     
@@ -152,6 +249,16 @@ async def search_with_context(
         include_context=True
     )
     
+    if accept and 'text/plain' in accept:
+        return PlainTextResponse(
+            result['context_text'],
+            headers={
+                'X-Total-Tokens': str(result['total_tokens']),
+                'X-Chunks-Used': str(len(result['chunks'])),
+                'X-Sources-Count': str(len(result['sources'])),
+            }
+        )
+    
     # Format sources
     sources = [
         SourceInfo(
@@ -203,7 +310,7 @@ async def search_within_document(
         chunk_result = ChunkResult(
             chunk_id=chunk['chunk_id'],
             document_id=chunk['document_id'],
-            content=chunk['content'][:500] + '...' if len(chunk['content']) > 500 else chunk['content'],
+            content=_preview_content(chunk['content']),
             chunk_type=chunk['chunk_type'],
             page_numbers=chunk['page_numbers'],
             section_title=chunk.get('section_title'),
@@ -233,6 +340,7 @@ async def test_search_endpoint():
         "message": "Search API is ready",
         "endpoints": [
             "POST /search - General search",
+            "POST /search/batch - Several searches in one request",
             "POST /search/context - Search with context",
             "POST /search/document/{id} - Document-specific search"
         ]
@@ -63,6 +63,7 @@ class Settings(BaseSettings):
     # Cohere Configuration
     cohere_api_key: str
     cohere_rerank_model: str = "rerank-english-v3.0"
+    rerank_max_concurrency: int = Field(default=16, env="RERANK_MAX_CONCURRENCY")
     
     # JWT Authentication
     secret_key: str
@@ -87,6 +88,9 @@ class Settings(BaseSettings):
     max_upload_size_mb: int = 50
     allowed_extensions: str = "pdf,docx,doc,txt,xlsx,xls"
     upload_dir: str = "./data/uploads"
+    # Dedup hash for uploads: "sha256" or "blake3" (stored as "b3:<hex>").
+    # Duplicates are only detected against documents hashed with the same algorithm.
+    file_hash_algorithm: str = Field(default="sha256", env="FILE_HASH_ALGORITHM")
     processed_dir: str = "./data/processed"
     
     @property
@@ -110,6 +114,8 @@ class Settings(BaseSettings):
     rerank_top_k: int = 8
     similarity_threshold: float = Field(default=0.3, env="SIMILARITY_THRESHOLD")
     hybrid_alpha: float = 0.7
+    # Skip reranking when the top-1 vs top-k fused score gap exceeds this (0 disables)
+    rerank_skip_gap: float = Field(default=0.0, env="RERANK_SKIP_GAP")
 
     # Dynamic retrieval settings
     enable_dynamic_scope: bool = Field(default=True, env="ENABLE_DYNAMIC_SCOPE")
@@ -16,6 +16,7 @@ from loguru import logger
 
 from app.core.config import settings
 from app.db.session import init_db, close_db
+from app.services.retrieval.reranker import reranking_service
 
 # Routers
 from app.api.endpoints.health import router as health_router
@@ -68,6 +69,7 @@ async def lifespan(app: FastAPI):
 
     yield
 
+    await reranking_service.aclose()
     await close_db()
     logger.info("🛑 Application shutdown complete")
 
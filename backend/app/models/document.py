@@ -30,7 +30,7 @@ class Document(Base):
     original_filename = Column(String(255), nullable=False)
     file_path = Column(String(512), nullable=False)
     file_size_bytes = Column(Integer, nullable=False)
-    file_hash = Column(String(64), nullable=False, unique=True, index=True)
+    file_hash = Column(String(80), nullable=False, unique=True, index=True)
 
     # Classification
     doc_type = Column(String(50), nullable=False, index=True)
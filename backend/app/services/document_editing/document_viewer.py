@@ -11,6 +11,7 @@ from sqlalchemy import select
 from loguru import logger
 
 from app.models.document import Document
+from app.utils.file_utils import FileHandler
 
 
 class DocumentViewerService:
@@ -48,7 +49,7 @@ class DocumentViewerService:
             'file_path': str(file_path),
             'file_exists': file_path.exists(),
             'file_size_bytes': document.file_size_bytes,
-            'file_size_mb': round(document.file_size_bytes / (1024 * 1024), 2),
+            'file_size_mb': round(FileHandler.get_file_size_mb_from_bytes(document.file_size_bytes), 2),
             'doc_type': document.doc_type,
             'department': document.department,
             'total_pages': document.total_pages,
@@ -343,6 +343,36 @@ class EmbeddingService:
             self.use_local_fallback = True
             self._init_local_model()
             return await self._generate_embedding_local(enhanced_query)
+    
+    async def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Generate embeddings for several search queries in one call."""
+        if not queries:
+            return []
+        
+        enhanced_queries = [f"Query: {query}" for query in queries]
+        
+        if not self.use_local_fallback:
+            try:
+                loop = asyncio.get_event_loop()
+                result = await loop.run_in_executor(
+                    None,
+                    lambda: genai.embed_content(
+                        model=self.model_name,
+                        content=enhanced_queries,
+                        task_type="retrieval_query"
+                    )
+                )
+                embeddings = result['embedding']
+                if not isinstance(embeddings[0], list):
+                    # Single embedding returned for a one-query batch
+                    embeddings = [embeddings]
+                return [self._adjust_dimensions(emb) for emb in embeddings]
+            except Exception as e:
+                logger.warning(f"Batch query embedding failed, using local: {str(e)}")
+                self.use_local_fallback = True
+                self._init_local_model()
+        
+        return await self._generate_embeddings_batch_local(enhanced_queries)
 
 
 # Global instance
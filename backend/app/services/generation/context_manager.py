@@ -8,6 +8,8 @@ from collections import defaultdict
 from loguru import logger
 import re
 
+from app.services.retrieval.chunk_view import chunk_score
+
 
 class ConversationContext:
     """
@@ -190,10 +192,7 @@ class ConversationContext:
             return True
         
         # Check if results are actually relevant
-        avg_score = sum(
-            r.get('rerank_score', r.get('fused_score', r.get('similarity_score', 0)))
-            for r in initial_results
-        ) / len(initial_results)
+        avg_score = sum(chunk_score(r) for r in initial_results) / len(initial_results)
         
         # If average relevance is low, expand search
         from app.core.config import settings
@@ -0,0 +1,103 @@
+"""
+Per-chunk context formatting helpers for the retrieval pipeline.
+Kept free of pipeline state and fully annotated so the Docker build can
+compile this module with mypyc; the pure-Python version is the fallback.
+"""
+from typing import Any, Dict, List
+
+from loguru import logger
+
+from app.services.retrieval.chunk_view import ChunkView
+
+
+def safe_get_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Safely extract metadata from chunk, handling SQLAlchemy objects.
+
+    Args:
+        chunk: Chunk dictionary (may contain SQLAlchemy objects)
+
+    Returns:
+        Plain dictionary with metadata
+    """
+    metadata: Dict[str, Any] = {}
+
+    # Try different metadata keys
+    for meta_key in ('chunk_metadata', 'metadata', 'doc_metadata'):
+        if meta_key in chunk:
+            meta_obj: Any = chunk[meta_key]
+
+            # Handle different types
+            if isinstance(meta_obj, dict):
+                metadata = meta_obj
+                break
+            elif hasattr(meta_obj, '__dict__'):
+                # SQLAlchemy object - convert to dict
+                try:
+                    metadata = {k: v for k, v in meta_obj.__dict__.items() if not k.startswith('_')}
+                    break
+                except Exception as e:
+                    logger.debug(f"Could not extract __dict__ from metadata: {e}")
+            elif hasattr(meta_obj, 'keys') and hasattr(meta_obj, '__getitem__'):
+                # Mapping-like object
+                try:
+                    metadata = {k: meta_obj[k] for k in meta_obj.keys()}
+                    break
+                except Exception as e:
+                    logger.debug(f"Could not extract keys from metadata: {e}")
+
+    # Fallback: Extract from chunk itself if metadata is empty
+    if not metadata:
+        metadata = {
+            'document_title': chunk.get('document_name') or chunk.get('filename', 'Unknown'),
+            'doc_type': chunk.get('doc_type'),
+            'department': chunk.get('department'),
+        }
+
+    return metadata
+
+
+def format_chunk_for_context(chunk: ChunkView) -> str:
+    """
+    Format chunk with metadata for LLM context.
+
+    Returns:
+        Formatted chunk text with source information
+    """
+    chunk_metadata = chunk.metadata
+
+    # Build header
+    header_parts: List[str] = []
+
+    # Try to get document title from multiple sources
+    doc_title = (
+        chunk_metadata.get('document_title') or
+        chunk_metadata.get('filename') or
+        chunk.document_name
+    )
+
+    if doc_title:
+        header_parts.append(f"Document: {doc_title}")
+
+    if chunk.section_title:
+        header_parts.append(f"Section: {chunk.section_title}")
+
+    if chunk.page_numbers:
+        if len(chunk.page_numbers) == 1:
+            header_parts.append(f"Page: {chunk.first_page}")
+        else:
+            header_parts.append(f"Pages: {chunk.first_page}-{chunk.last_page}")
+
+    chunk_type = chunk.chunk_type
+    if chunk_type and chunk_type != 'text':
+        header_parts.append(f"Type: {chunk_type.title()}")
+
+    # Format final output
+    if header_parts:
+        header = " | ".join(header_parts)
+        return f"[{header}]\n{chunk.content}"
+    else:
+        return chunk.content
+
+
+__all__ = ['format_chunk_for_context', 'safe_get_metadata']
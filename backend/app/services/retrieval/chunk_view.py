@@ -0,0 +1,65 @@
+"""
+Typed view over retrieved chunk dictionaries.
+Resolves key fallbacks once per chunk so context assembly uses plain attributes.
+"""
+from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field
+
+
+def chunk_score(chunk: Dict[str, Any]) -> float:
+    """
+    Best available relevance score for a chunk.
+
+    Prefers the rerank score, then the fused hybrid score, then raw similarity.
+    """
+    for key in ('rerank_score', 'fused_score', 'similarity_score'):
+        score = chunk.get(key)
+        if score is not None:
+            return score
+    return 0
+
+
+@dataclass(slots=True)
+class ChunkView:
+    """Read-mostly view of the chunk fields used during context assembly."""
+    chunk: Dict[str, Any]
+    content: str
+    chunk_id: str
+    score: float
+    chunk_type: Optional[str]
+    page_numbers: List[int]
+    first_page: Optional[int]
+    last_page: Optional[int]
+    section_title: Optional[str]
+    token_count: int
+    document_name: Optional[str]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_chunk(
+        cls,
+        chunk: Dict[str, Any],
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> 'ChunkView':
+        """Build a view from a retrieval result dict (the dict is kept by reference)."""
+        page_numbers = chunk.get('page_numbers')
+        if not isinstance(page_numbers, list):
+            page_numbers = []
+
+        return cls(
+            chunk=chunk,
+            content=chunk.get('content') or '',
+            chunk_id=str(chunk.get('chunk_id', chunk.get('id', ''))),
+            score=chunk_score(chunk),
+            chunk_type=chunk.get('chunk_type', 'text'),
+            page_numbers=page_numbers,
+            first_page=page_numbers[0] if page_numbers else None,
+            last_page=page_numbers[-1] if page_numbers else None,
+            section_title=chunk.get('section_title'),
+            token_count=chunk.get('token_count') or 0,
+            document_name=chunk.get('document_name') or chunk.get('filename'),
+            metadata=metadata or {}
+        )
+
+
+__all__ = ['ChunkView', 'chunk_score']
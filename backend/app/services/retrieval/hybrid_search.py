@@ -34,9 +34,15 @@ class HybridSearchService:
         doc_type: Optional[str] = None,
         department: Optional[str] = None,
         document_filter: Optional[List[str]] = None,
-        boost_documents: Optional[List[str]] = None
+        boost_documents: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
-        """Perform hybrid search with optional document scoping and boosting."""
+        """
+        Perform hybrid search with optional document scoping and boosting.
+        
+        Pass a precomputed query_embedding to avoid embedding the same
+        query again when the caller runs several searches per request.
+        """
         k = top_k or self.top_k
         
         logger.info(f"Hybrid search: query='{query[:50]}...', k={k}")
@@ -59,7 +65,8 @@ class HybridSearchService:
         # 1. Semantic search
         if use_semantic:
             logger.info("Running semantic search...")
-            query_embedding = await embedding_service.embed_query(query)
+            if query_embedding is None:
+                query_embedding = await embedding_service.embed_query(query)
             
             semantic_results = await vector_search_service.search_similar_chunks(
                 query_embedding=query_embedding,
@@ -188,7 +195,8 @@ class HybridSearchService:
         top_k: Optional[int] = None,
         expand_neighbors: bool = True,
         document_filter: Optional[List[str]] = None,  # NEW
-        boost_documents: Optional[List[str]] = None   # NEW
+        boost_documents: Optional[List[str]] = None,  # NEW
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         Hybrid search with automatic context expansion and document scoping.
@@ -200,6 +208,7 @@ class HybridSearchService:
             expand_neighbors: Whether to include neighboring chunks
             document_filter: List of documents to restrict search
             boost_documents: List of documents to boost
+            query_embedding: Precomputed query embedding (computed if omitted)
             
         Returns:
             List of chunks with context expansion
@@ -210,45 +219,24 @@ class HybridSearchService:
             db=db,
             top_k=top_k,
             document_filter=document_filter,  # NEW
-            boost_documents=boost_documents   # NEW
+            boost_documents=boost_documents,  # NEW
+            query_embedding=query_embedding
         )
         
         if not expand_neighbors:
             return initial_results
         
+        neighbors_by_parent = await self.fetch_neighbors(initial_results, db)
+        
         # Expand context for top results
         expanded_results = []
         seen_chunk_ids = set()
         
         for result in initial_results[:5]:
-            chunk_id_raw = result.get('chunk_id') or result.get('id')
-            
-            if not chunk_id_raw:
-                logger.warning(f"Chunk missing ID, skipping: {result}")
-                continue
-            
-            try:
-                from uuid import UUID
-                chunk_id = UUID(str(chunk_id_raw))
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Invalid chunk ID format: {chunk_id_raw}, error: {e}")
-                continue
-            
-            # Get neighbors
-            neighbors = await vector_search_service.get_chunk_neighbors(
-                chunk_id=chunk_id,
-                db=db,
-                n_before=1,
-                n_after=1
-            )
-            
             # Add all neighbors to results
-            for neighbor in neighbors:
+            for neighbor in neighbors_by_parent.get(result.get('chunk_id'), []):
                 nid = neighbor['chunk_id']
                 if nid not in seen_chunk_ids:
-                    neighbor['is_expanded_context'] = not neighbor['is_target']
-                    neighbor['parent_chunk_id'] = result['chunk_id'] if not neighbor['is_target'] else None
-                    
                     if neighbor['is_target']:
                         neighbor.update({
                             'fused_score': result['fused_score'],
@@ -271,7 +259,55 @@ class HybridSearchService:
         logger.info(f"Context expansion: {len(initial_results)} → {len(expanded_results)} chunks")
         
         return expanded_results
-
+    
+    async def fetch_neighbors(
+        self,
+        results: List[Dict[str, Any]],
+        db: AsyncSession,
+        max_expand: int = 5
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetch neighboring chunks for the top search results.
+        
+        Args:
+            results: Ranked search results
+            db: Database session
+            max_expand: Number of top results to expand
+            
+        Returns:
+            Mapping of result chunk_id to its neighbors in document order
+            (the result's own chunk is included with is_target=True)
+        """
+        neighbors_by_parent = {}
+        
+        for result in results[:max_expand]:
+            chunk_id_raw = result.get('chunk_id') or result.get('id')
+            
+            if not chunk_id_raw:
+                logger.warning(f"Chunk missing ID, skipping: {result}")
+                continue
+            
+            try:
+                chunk_id = UUID(str(chunk_id_raw))
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Invalid chunk ID format: {chunk_id_raw}, error: {e}")
+                continue
+            
+            # Get neighbors
+            neighbors = await vector_search_service.get_chunk_neighbors(
+                chunk_id=chunk_id,
+                db=db,
+                n_before=1,
+                n_after=1
+            )
+            
+            for neighbor in neighbors:
+                neighbor['is_expanded_context'] = not neighbor['is_target']
+                neighbor['parent_chunk_id'] = result['chunk_id'] if not neighbor['is_target'] else None
+            
+            neighbors_by_parent[result['chunk_id']] = neighbors
+        
+        return neighbors_by_parent
 
 # Global instance
 hybrid_search_service = HybridSearchService()
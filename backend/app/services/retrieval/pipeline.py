@@ -3,6 +3,7 @@ Complete retrieval pipeline orchestrator.
 Coordinates query processing, hybrid search, reranking, and context assembly.
 """
 from typing import List, Dict, Any, Optional
+import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
@@ -10,6 +11,9 @@ from app.core.config import settings
 from app.services.retrieval.query_processor import query_processor
 from app.services.retrieval.hybrid_search import hybrid_search_service
 from app.services.retrieval.reranker import reranking_service
+from app.services.embedding.embedding_service import embedding_service
+from app.services.retrieval.chunk_view import ChunkView
+from app.services.retrieval._format import format_chunk_for_context, safe_get_metadata
 
 from typing import TYPE_CHECKING
 
@@ -36,7 +40,8 @@ class RetrievalPipeline:
         department: Optional[str] = None,
         include_context: bool = True,
         conversation_context: Optional['ConversationContext'] = None,
-        force_global: bool = False
+        force_global: bool = False,
+        query_embedding: Optional[List[float]] = None
     ) -> Dict[str, Any]:
         """
         Complete retrieval pipeline with conversation context awareness and dynamic scoping.
@@ -50,6 +55,7 @@ class RetrievalPipeline:
             include_context: Whether to expand with neighboring chunks
             conversation_context: Conversation context for document scoping
             force_global: Force global search (skip scoping)
+            query_embedding: Precomputed query embedding (e.g. from a batch), skips embedding the query
             
         Returns:
             Dictionary with retrieved chunks and metadata
@@ -96,19 +102,25 @@ class RetrievalPipeline:
         else:
             logger.info("  Strategy: Hybrid (semantic + keyword)")
 
+        # Embed the query once and reuse it for every search below.
+        # Context expansion always runs semantic search, so it needs it too.
+        if query_embedding is None and (use_semantic or include_context):
+            query_embedding = await embedding_service.embed_query(query)
+
         # Step 4: Execute search with dynamic scoping
         initial_top_k = settings.scoped_search_top_k if use_scoped_search else settings.global_search_top_k
 
         logger.info(f"Step 3: Performing {'scoped' if use_scoped_search else 'global'} hybrid search (k={initial_top_k})...")
 
         if include_context:
-            search_results = await hybrid_search_service.search_with_context_expansion(
+            # Neighbor expansion is deferred until reranking (see Step 6)
+            search_results = await hybrid_search_service.search(
                 query=query,
                 db=db,
                 top_k=initial_top_k,
-                expand_neighbors=True,
                 document_filter=None,  # CRITICAL: No hard filtering
-                boost_documents=boost_documents  # Only boosting
+                boost_documents=boost_documents,  # Only boosting
+                query_embedding=query_embedding
             )
         else:
             search_results = await hybrid_search_service.search(
@@ -120,7 +132,8 @@ class RetrievalPipeline:
                 doc_type=doc_type,
                 department=department,
                 document_filter=None,  # CRITICAL: No hard filtering
-                boost_documents=boost_documents  # Only boosting
+                boost_documents=boost_documents,  # Only boosting
+                query_embedding=query_embedding
             )
 
         logger.info(f"  Initial search: {len(search_results)} chunks")
@@ -143,56 +156,73 @@ class RetrievalPipeline:
                     doc_type=doc_type,
                     department=department,
                     document_filter=None,
-                    boost_documents=[]  # No boosting in global search
+                    boost_documents=[],  # No boosting in global search
+                    query_embedding=query_embedding
                 )
                 
                 logger.info(f"  Global search: {len(global_results)} chunks")
                 
                 # Merge results: prioritize scoped but include global
-                seen_ids = set()
-                merged_results = []
-                
-                # Add scoped results first (boosted)
-                for chunk in search_results:
-                    chunk_id = chunk.get('chunk_id')
-                    if chunk_id and chunk_id not in seen_ids:
-                        chunk['source_type'] = 'scoped'
-                        merged_results.append(chunk)
-                        seen_ids.add(chunk_id)
-                
-                # Add global results
-                for chunk in global_results:
-                    chunk_id = chunk.get('chunk_id')
-                    if chunk_id and chunk_id not in seen_ids:
-                        chunk['source_type'] = 'global'
-                        merged_results.append(chunk)
-                        seen_ids.add(chunk_id)
-                
-                search_results = merged_results
+                search_results = self._merge_results(search_results, global_results)
                 logger.info(f"  Merged results: {len(search_results)} total chunks")
 
         # Step 6: Rerank results (CRITICAL - DO NOT SKIP)
         reranked_results = []
         
-        if self.rerank_enabled and len(search_results) > 1:
-            logger.info("Step 4: Reranking results...")
-            try:
-                reranked_results = await reranking_service.rerank(
-                    query=query,
-                    chunks=search_results,
-                    top_n=top_k or settings.rerank_top_k
-                )
-                
-                stats = reranking_service.calculate_score_statistics(reranked_results)
-                logger.info(f"  Rerank scores: min={stats['min_score']:.3f}, max={stats['max_score']:.3f}, avg={stats['avg_score']:.3f}")
-            except Exception as e:
-                logger.error(f"Reranking failed: {str(e)}, using original order")
+        # Fetch neighbors of the pre-rerank top results while the rerank call
+        # is in flight. Reranking never touches the DB session, so the two can
+        # overlap; reranked chunks the prefetch missed are expanded afterwards.
+        expand_task = None
+        if include_context:
+            expand_task = asyncio.create_task(
+                hybrid_search_service.fetch_neighbors(search_results, db)
+            )
+        
+        try:
+            if self.rerank_enabled and self._should_skip_rerank(search_results, top_k or settings.rerank_top_k):
+                logger.info("Step 4: Skipping reranking (top results already well separated)")
                 reranked_results = search_results[:top_k or settings.rerank_top_k]
-        else:
-            logger.info("Step 4: Skipping reranking (disabled or insufficient results)")
-            reranked_results = search_results[:top_k or settings.rerank_top_k]
-
-        logger.info(f"  After reranking: {len(reranked_results)} chunks")
+            elif self.rerank_enabled and len(search_results) > 1:
+                logger.info("Step 4: Reranking results...")
+                try:
+                    reranked_results = await reranking_service.rerank(
+                        query=query,
+                        chunks=search_results,
+                        top_n=top_k or settings.rerank_top_k
+                    )
+                    
+                    stats = reranking_service.calculate_score_statistics(reranked_results)
+                    logger.info(f"  Rerank scores: min={stats['min_score']:.3f}, max={stats['max_score']:.3f}, avg={stats['avg_score']:.3f}")
+                except Exception as e:
+                    logger.error(f"Reranking failed: {str(e)}, using original order")
+                    reranked_results = search_results[:top_k or settings.rerank_top_k]
+            else:
+                logger.info("Step 4: Skipping reranking (disabled or insufficient results)")
+                reranked_results = search_results[:top_k or settings.rerank_top_k]
+            
+            reranked_count = len(reranked_results)
+            logger.info(f"  After reranking: {reranked_count} chunks")
+            
+            if expand_task is not None:
+                neighbors_by_parent = await expand_task
+                
+                # Expand the union of the pre-rerank and reranked top results
+                missing = [
+                    chunk for chunk in reranked_results[:5]
+                    if chunk.get('chunk_id') not in neighbors_by_parent
+                ]
+                if missing:
+                    neighbors_by_parent.update(
+                        await hybrid_search_service.fetch_neighbors(missing, db)
+                    )
+                
+                reranked_results = self._attach_neighbors(reranked_results, neighbors_by_parent)
+                logger.info(f"  Context expansion: {len(reranked_results)} chunks")
+        finally:
+            # Don't leave the prefetch running on the session if anything above failed
+            if expand_task is not None and not expand_task.done():
+                expand_task.cancel()
+                await asyncio.gather(expand_task, return_exceptions=True)
         
         # Step 7: Assemble final context
         logger.info("Step 5: Assembling context...")
@@ -213,7 +243,7 @@ class RetrievalPipeline:
             'retrieval_metadata': {
                 'search_strategy': 'hybrid' if (use_semantic and use_keyword) else ('semantic' if use_semantic else 'keyword'),
                 'total_retrieved': len(search_results),
-                'after_reranking': len(reranked_results),
+                'after_reranking': reranked_count,
                 'final_chunks': len(final_context['chunks']),
                 'intent': processed_query['intent'],
                 'complexity': processed_query['complexity'],
@@ -224,59 +254,98 @@ class RetrievalPipeline:
             }
         }
     
-    def _safe_get_metadata(self, chunk: Dict[str, Any]) -> dict:
+    def _should_skip_rerank(self, search_results: List[Dict[str, Any]], top_n: int) -> bool:
         """
-        Safely extract metadata from chunk, handling SQLAlchemy objects.
+        Decide whether reranking can be skipped for this result set.
         
-        Args:
-            chunk: Chunk dictionary (may contain SQLAlchemy objects)
-            
-        Returns:
-            Plain dictionary with metadata
+        Skips only when settings.rerank_skip_gap is set and the fused score
+        gap between rank 1 and rank top_n exceeds it.
+        """
+        if settings.rerank_skip_gap <= 0 or len(search_results) <= 1:
+            return False
+        
+        scores = sorted(
+            (chunk.get('fused_score') or chunk.get('similarity_score') or 0 for chunk in search_results),
+            reverse=True
+        )
+        gap = scores[0] - scores[min(len(scores) - 1, top_n)]
+        
+        logger.info(f"  Fused score gap top-1 vs top-{top_n}: {gap:.4f} (skip threshold {settings.rerank_skip_gap})")
+        
+        return gap > settings.rerank_skip_gap
+    
+    @staticmethod
+    def _attach_neighbors(
+        reranked_results: List[Dict[str, Any]],
+        neighbors_by_parent: Dict[str, List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
         """
-        metadata = {}
+        Place prefetched neighbor chunks around the reranked chunks they belong to.
         
-        # Try different metadata keys
-        for meta_key in ['chunk_metadata', 'metadata', 'doc_metadata']:
-            if meta_key in chunk:
-                meta_obj = chunk[meta_key]
+        Only chunks that survived reranking are expanded. Neighbors inherit
+        their parent's scores so they stay next to it when prioritized, and
+        neighbors that were reranked on their own are not duplicated.
+        """
+        reranked_ids = {chunk.get('chunk_id') for chunk in reranked_results}
+        seen_chunk_ids = set()
+        expanded_results = []
+        
+        for chunk in reranked_results:
+            chunk_id = chunk.get('chunk_id')
+            
+            for neighbor in neighbors_by_parent.get(chunk_id, []):
+                if neighbor['is_target']:
+                    item = chunk
+                    chunk.setdefault('is_expanded_context', False)
+                elif neighbor['chunk_id'] in reranked_ids:
+                    continue
+                else:
+                    item = neighbor
+                    for key in ('rerank_score', 'fused_score', 'boosted'):
+                        if key in chunk:
+                            neighbor[key] = chunk[key]
                 
-                # Handle different types
-                if isinstance(meta_obj, dict):
-                    metadata = meta_obj
-                    break
-                elif hasattr(meta_obj, '__dict__'):
-                    # SQLAlchemy object - convert to dict
-                    try:
-                        metadata = {k: v for k, v in meta_obj.__dict__.items() if not k.startswith('_')}
-                        break
-                    except Exception as e:
-                        logger.debug(f"Could not extract __dict__ from metadata: {e}")
-                        pass
-                elif hasattr(meta_obj, 'keys') and hasattr(meta_obj, '__getitem__'):
-                    # Mapping-like object
-                    try:
-                        metadata = {k: meta_obj[k] for k in meta_obj.keys()}
-                        break
-                    except Exception as e:
-                        logger.debug(f"Could not extract keys from metadata: {e}")
-                        pass
-        
-        # Fallback: Extract from chunk itself if metadata is empty
-        if not metadata:
-            metadata = {
-                'document_title': chunk.get('document_name') or chunk.get('filename', 'Unknown'),
-                'doc_type': chunk.get('doc_type'),
-                'department': chunk.get('department'),
-            }
+                if item['chunk_id'] not in seen_chunk_ids:
+                    expanded_results.append(item)
+                    seen_chunk_ids.add(item['chunk_id'])
+            
+            if chunk_id not in seen_chunk_ids:
+                chunk.setdefault('is_expanded_context', False)
+                expanded_results.append(chunk)
+                seen_chunk_ids.add(chunk_id)
         
-        return metadata
+        return expanded_results
+    
+    @staticmethod
+    def _merge_results(
+        scoped_results: List[Dict[str, Any]],
+        global_results: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Merge scoped and global results, keeping scoped chunks first.
+        
+        Chunks without an ID or already seen are dropped. Each kept chunk
+        is tagged with 'source_type' ('scoped' or 'global').
+        """
+        seen_ids = set()
+        merged_results = []
+        
+        for source_type, results in (('scoped', scoped_results), ('global', global_results)):
+            for chunk in results:
+                chunk_id = chunk.get('chunk_id')
+                if not chunk_id or chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                chunk['source_type'] = source_type
+                merged_results.append(chunk)
+        
+        return merged_results
     
     def _prioritize_chunks(
         self,
-        chunks: List[Dict[str, Any]],
+        chunks: List[ChunkView],
         processed_query: Dict[str, Any]
-    ) -> List[Dict[str, Any]]:
+    ) -> List[ChunkView]:
         """
         Prioritize chunks based on type and relevance.
         
@@ -292,20 +361,13 @@ class RetrievalPipeline:
         intent = processed_query.get('intent', 'general')
         entities = processed_query.get('entities', {})
         has_financial_entities = 'amount' in entities or 'financial' in intent.lower()
+        boost_tables = intent in ['financial', 'analytical'] or has_financial_entities
         
-        def get_priority(chunk: Dict[str, Any]) -> tuple:
+        def get_priority(chunk: ChunkView) -> tuple:
             # Higher number = higher priority (sort descending)
-            priority = 0
-            
-            # Boost tables for financial/analytical queries
-            chunk_type = chunk.get('chunk_type', 'text')
-            if chunk_type == 'table' and (intent in ['financial', 'analytical'] or has_financial_entities):
-                priority += 1000
-            
-            # Use rerank score as primary sort
-            rerank_score = chunk.get('rerank_score', chunk.get('fused_score', chunk.get('similarity_score', 0)))
-            
-            return (priority, rerank_score)
+            # Boost tables for financial/analytical queries, then use rerank score
+            priority = 1000 if boost_tables and chunk.chunk_type == 'table' else 0
+            return (priority, chunk.score)
         
         # Sort by priority
         try:
@@ -338,31 +400,35 @@ class RetrievalPipeline:
                 'sources': []
             }
         
-        sorted_chunks = self._prioritize_chunks(chunks, processed_query)
+        # Resolve key fallbacks and metadata once per chunk
+        views = [
+            ChunkView.from_chunk(chunk, safe_get_metadata(chunk))
+            for chunk in chunks
+        ]
+        sorted_views = self._prioritize_chunks(views, processed_query)
         
         max_tokens = min(self.max_context_tokens, 6000)
         
-        for chunk in sorted_chunks:
-            chunk_tokens = chunk.get('token_count', 0)
+        for view in sorted_views:
+            chunk = view.chunk
+            chunk_tokens = view.token_count
             
             if chunk_tokens > 800:
-                chunk['content'] = chunk['content'][:3200]
+                view.content = chunk['content'] = view.content[:3200]
                 chunk_tokens = 800
             
             if total_tokens + chunk_tokens > max_tokens:
                 logger.warning(f"Reached token limit ({max_tokens}), stopping context assembly")
                 break
             
-            chunk_text = self._format_chunk_for_context(chunk)
+            chunk_text = format_chunk_for_context(view)
             context_parts.append(chunk_text)
             
-            chunk_metadata = self._safe_get_metadata(chunk)
-            
             source_info = {
-                'document': chunk_metadata.get('document_title', chunk.get('document_name', 'Unknown Document')),
-                'page': chunk.get('page_numbers', [None])[0] if chunk.get('page_numbers') else None,
-                'section': chunk.get('section_title'),
-                'chunk_id': str(chunk.get('chunk_id', chunk.get('id', '')))
+                'document': view.metadata.get('document_title', chunk.get('document_name', 'Unknown Document')),
+                'page': view.first_page,
+                'section': view.section_title,
+                'chunk_id': view.chunk_id
             }
             
             if source_info not in sources:
@@ -382,55 +448,6 @@ class RetrievalPipeline:
             'sources': sources
         }
     
-    def _format_chunk_for_context(self, chunk: Dict[str, Any]) -> str:
-        """
-        Format chunk with metadata for LLM context.
-        
-        Returns:
-            Formatted chunk text with source information
-        """
-        # ✅ Use safe metadata extraction
-        chunk_metadata = self._safe_get_metadata(chunk)
-        
-        # Build header
-        header_parts = []
-        
-        # Try to get document title from multiple sources
-        doc_title = (
-            chunk_metadata.get('document_title') or 
-            chunk_metadata.get('filename') or
-            chunk.get('document_name') or 
-            chunk.get('filename')
-        )
-        
-        if doc_title:
-            header_parts.append(f"Document: {doc_title}")
-        
-        section_title = chunk.get('section_title')
-        if section_title:
-            header_parts.append(f"Section: {section_title}")
-        
-        page_numbers = chunk.get('page_numbers', [])
-        if page_numbers and isinstance(page_numbers, list) and len(page_numbers) > 0:
-            if len(page_numbers) == 1:
-                header_parts.append(f"Page: {page_numbers[0]}")
-            else:
-                header_parts.append(f"Pages: {page_numbers[0]}-{page_numbers[-1]}")
-        
-        chunk_type = chunk.get('chunk_type', 'text')
-        if chunk_type and chunk_type != 'text':
-            header_parts.append(f"Type: {chunk_type.title()}")
-        
-        # Get content
-        content = chunk.get('content', '')
-        
-        # Format final output
-        if header_parts:
-            header = " | ".join(header_parts)
-            return f"[{header}]\n{content}"
-        else:
-            return content
-    
     async def retrieve_from_document(
         self,
         query: str,
@@ -450,7 +467,6 @@ class RetrievalPipeline:
         processed_query = query_processor.process_query(query)
         
         # Search within document
-        from app.services.embedding.embedding_service import embedding_service
         from app.services.retrieval.vector_search import vector_search_service
         
         query_embedding = await embedding_service.embed_query(query)
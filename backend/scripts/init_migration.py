@@ -7,27 +7,22 @@ import sys
 from pathlib import Path
 
 
-def run_command(cmd: list[str], description: str) -> None:
-    """Execute a shell command with error handling."""
+def _print_header(description: str) -> None:
+    """Print a step banner."""
     print(f"\n{'='*60}")
     print(f"🚀 {description}")
     print(f"{'='*60}\n")
+
+
+def run_command(cmd: list[str], description: str) -> None:
+    """Execute a shell command with error handling (output streams to the console)."""
+    _print_header(description)
     
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(result.stdout)
-        if result.stderr:
-            print(f"⚠️  Warnings: {result.stderr}")
+        subprocess.run(cmd, check=True)
         print(f"✅ {description} completed successfully!\n")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error during {description}:")
-        print(f"stdout: {e.stdout}")
-        print(f"stderr: {e.stderr}")
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ Error during {description}: {e}")
         sys.exit(1)
 
 
@@ -15,9 +15,10 @@ import httpx
 from loguru import logger
 from backend.app.core.config import settings
 
+BASE_URL = f"http://localhost:8000{settings.api_v1_prefix}"
 
 
-async def test_document_upload():
+async def _run_document_upload(client: httpx.AsyncClient):
     """Test document upload via API."""
     
     logger.info("="*60)
@@ -63,83 +64,83 @@ We project continued growth in 2025 with expected revenue of $7 million.
 """)
         logger.info(f"Created test file: {test_file_path}")
     
+    # Read the file off the event loop so concurrent uploads don't block each other
+    content = await asyncio.to_thread(test_file_path.read_bytes)
+    
     # Upload document via API
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        with open(test_file_path, "rb") as f:
-            files = {"file": (test_file_path.name, f, "text/plain")}
-            params = {
-                "doc_type": "finance",
-                "department": "Finance Department"
-            }
-            
-            logger.info("Uploading document...")
-            response = await client.post(
-                f"http://localhost:8000{settings.api_v1_prefix}/documents/upload",
-                files=files,
-                params=params
-            )
+    files = {"file": (test_file_path.name, content, "text/plain")}
+    params = {
+        "doc_type": "finance",
+        "department": "Finance Department"
+    }
+    
+    logger.info("Uploading document...")
+    response = await client.post(
+        "/documents/upload",
+        files=files,
+        params=params
+    )
+    
+    if response.status_code == 200:
+        result = response.json()
+        logger.info(f"✅ Upload successful!")
+        logger.info(f"   Document ID: {result['document_id']}")
+        logger.info(f"   Status: {result['status']}")
+        logger.info(f"   Message: {result['message']}")
         
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"✅ Upload successful!")
-            logger.info(f"   Document ID: {result['document_id']}")
-            logger.info(f"   Status: {result['status']}")
-            logger.info(f"   Message: {result['message']}")
-            
-            document_id = result['document_id']
-            
-            # Wait for processing to complete
-            logger.info("\nWaiting for document processing...")
-            await asyncio.sleep(10)  # Give it time to process
-            
-            # Check status
-            status_response = await client.get(
-                f"http://localhost:8000{settings.api_v1_prefix}/documents/{document_id}/status"
-            )
-            
-            if status_response.status_code == 200:
-                status = status_response.json()
-                logger.info(f"\n✅ Processing Status:")
-                logger.info(f"   Status: {status['status']}")
-                logger.info(f"   Total Pages: {status['total_pages']}")
-                logger.info(f"   Total Chunks: {status['total_chunks']}")
-                logger.info(f"   Processed Date: {status['processed_date']}")
-                
-                if status['error']:
-                    logger.error(f"   Error: {status['error']}")
+        document_id = result['document_id']
+        
+        # Wait for processing to complete
+        logger.info("\nWaiting for document processing...")
+        await asyncio.sleep(10)  # Give it time to process
+        
+        # Check status
+        status_response = await client.get(
+            f"/documents/{document_id}/status"
+        )
+        
+        if status_response.status_code == 200:
+            status = status_response.json()
+            logger.info(f"\n✅ Processing Status:")
+            logger.info(f"   Status: {status['status']}")
+            logger.info(f"   Total Pages: {status['total_pages']}")
+            logger.info(f"   Total Chunks: {status['total_chunks']}")
+            logger.info(f"   Processed Date: {status['processed_date']}")
             
-            return document_id
-        else:
-            logger.error(f"❌ Upload failed: {response.status_code}")
-            logger.error(f"   Response: {response.text}")
-            return None
+            if status['error']:
+                logger.error(f"   Error: {status['error']}")
+        
+        return document_id
+    else:
+        logger.error(f"❌ Upload failed: {response.status_code}")
+        logger.error(f"   Response: {response.text}")
+        return None
 
 
-async def test_document_listing():
+async def _run_document_listing(client: httpx.AsyncClient):
     """Test document listing API."""
     
     logger.info("\n" + "="*60)
     logger.info("Testing Document Listing API")
     logger.info("="*60)
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"http://localhost:8000{settings.api_v1_prefix}/documents",
-            params={"limit": 10}
-        )
+    response = await client.get(
+        "/documents",
+        params={"limit": 10}
+    )
+    
+    if response.status_code == 200:
+        result = response.json()
+        logger.info(f"\n✅ Found {result['total']} documents")
         
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"\n✅ Found {result['total']} documents")
-            
-            for doc in result['documents']:
-                logger.info(f"\n   Document: {doc['filename']}")
-                logger.info(f"   ID: {doc['id']}")
-                logger.info(f"   Type: {doc['doc_type']}")
-                logger.info(f"   Status: {doc['status']}")
-                logger.info(f"   Chunks: {doc['total_chunks']}")
-        else:
-            logger.error(f"❌ Listing failed: {response.status_code}")
+        for doc in result['documents']:
+            logger.info(f"\n   Document: {doc['filename']}")
+            logger.info(f"   ID: {doc['id']}")
+            logger.info(f"   Type: {doc['doc_type']}")
+            logger.info(f"   Status: {doc['status']}")
+            logger.info(f"   Chunks: {doc['total_chunks']}")
+    else:
+        logger.error(f"❌ Listing failed: {response.status_code}")
 
 
 async def test_chunk_retrieval():
@@ -196,11 +197,13 @@ async def main():
     logger.info("="*60 + "\n")
     
     try:
-        # Test 1: Upload document
-        document_id = await test_document_upload()
-        
-        # Test 2: List documents
-        await test_document_listing()
+        # One client for both API tests so the connection is reused
+        async with httpx.AsyncClient(base_url=BASE_URL, timeout=120.0) as client:
+            # Test 1: Upload document
+            document_id = await _run_document_upload(client)
+            
+            # Test 2: List documents
+            await _run_document_listing(client)
         
         # Test 3: Retrieve chunks
         await test_chunk_retrieval()